@@ -1,21 +1,58 @@
 import requests
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+from urllib3.util.retry import Retry
 import csv
+import gzip
+import io
+import orjson
 import logging
+import os
 import argparse
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from itertools import chain
+
+# Fields with this suffix hold dates in seconds and are converted to 'dd-mm-yyyy'
+DATE_SUFFIX = "_date"
+
+
+class FetchError(Exception):
+    """
+    Raised when an API endpoint cannot be fetched completely.
+    """
 
 
 class StackOverflowDataPipeline:
-    def __init__(self, output_dir):
+    # API endpoint and sort order for each data type, written to stackoverflow_<endpoint>.csv
+    ENDPOINTS = (
+        ("questions", "votes"),
+        ("posts", "votes"),
+        ("users", "reputation"),
+        ("tags", "popular"),
+        ("comments", "votes"),
+    )
+
+    def __init__(self, output_dir, max_pages=1, compress=False):
         """
         Initializes the StackOverflowDataPipeline.
 
         Args:
             output_dir (str): The output directory for CSV files.
+            max_pages (int): The maximum number of pages to fetch per endpoint.
+            compress (bool): Whether to write gzip-compressed '.csv.gz' files.
         """
         self.base_url = "https://api.stackexchange.com/2.3"
         self.output_dir = output_dir
+        self.max_pages = max_pages
+        self.compress = compress
+
+        # Fail fast on an unusable output directory before any API requests are made
+        os.makedirs(self.output_dir, exist_ok=True)
+
         self.logger = self.setup_logger()
+        self.session = self.setup_session()
 
     def setup_logger(self):
         """
@@ -48,66 +85,127 @@ class StackOverflowDataPipeline:
 
         return logger
 
+    def setup_session(self):
+        """
+        Sets up a shared HTTP session so all API requests reuse one pooled connection.
+        Responses are cached on disk, so repeat runs revalidate instead of re-downloading.
+
+        Returns:
+            requests_cache.CachedSession: Configured session object.
+        """
+        session = CachedSession("so_cache.sqlite", backend="sqlite", cache_control=True, expire_after=3600)
+        session.headers.update({"Accept-Encoding": "gzip"})
+
+        # Retry throttled and transient upstream failures with exponential backoff
+        retry = Retry(total=5, backoff_factor=1.5, status_forcelist=[429, 502, 503, 504], respect_retry_after_header=True)
+
+        # Every endpoint lives on the same host, so a single pool keeps the TLS connection alive
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=8, max_retries=retry))
+
+        return session
+
     def fetch_data(self, endpoint, params):
         """
-        Fetches data from the specified API endpoint.
+        Fetches data from the specified API endpoint, following pagination up to max_pages.
+        Items are yielded page by page, so only one page is held in memory at a time.
 
         Args:
             endpoint (str): The URL endpoint for the API.
             params (dict): The query parameters for the API request.
 
-        Returns:
-            list: List of data items.
+        Yields:
+            dict: Data items.
+
+        Raises:
+            FetchError: If any page fails to be fetched or parsed.
         """
+        page = 1
         try:
-            response = requests.get(endpoint, params=params)
-            response.raise_for_status()  # Raises an exception for non-2xx status codes
-            return response.json()["items"]
-        except requests.exceptions.RequestException as e:
+            while True:
+                response = self.session.get(endpoint, params={**params, "page": page}, timeout=(3.05, 30))
+                response.raise_for_status()  # Raises an exception for non-2xx status codes
+                payload = orjson.loads(response.content)
+                yield from payload["items"]
+                if not payload.get("has_more") or page >= self.max_pages:
+                    return
+                # The API asks clients to wait this many seconds before calling the same method again
+                if "backoff" in payload and not response.from_cache:
+                    self.logger.info(f"Backing off {payload['backoff']}s before the next page of {endpoint}.")
+                    time.sleep(payload["backoff"])
+                page += 1
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             self.logger.error(f"Failed to fetch data from {endpoint}. Error: {e}")
-            return None
+            raise FetchError(f"Failed to fetch data from {endpoint}") from e
 
     def write_to_csv(self, data, csv_file):
         """
-        Writes data to a CSV file.
+        Writes data to a CSV file row by row as it is produced.
+        Rows go to a temporary file that only replaces the CSV once the data is complete.
 
         Args:
-            data (list): The data to be written.
+            data (iterable): The data to be written.
             csv_file (str): The path to the CSV file.
+
+        Returns:
+            bool: True if the data was written, False otherwise.
         """
-        if data:
-            fieldnames = data[0].keys()
-            transformed_data = self.transform_dates(data)
-            try:
-                with open(csv_file, "w", newline="", encoding="utf-8") as file:
-                    writer = csv.DictWriter(file, fieldnames=fieldnames, extrasaction='ignore')
-                    writer.writeheader()
-                    writer.writerows(transformed_data)
-            except IOError as e:
-                self.logger.error(f"Failed to write to CSV file: {csv_file}. Error: {e}")
-
-    def transform_dates(self, data):
+        tmp_file = f"{csv_file}.tmp"
+        try:
+            # Peek the first row for the field names; the file is left untouched if there is no data
+            data = iter(data)
+            first = next(data, None)
+            if first is None:
+                return False
+
+            fieldnames = list(first.keys())
+            date_keys = [key for key in fieldnames if key.endswith(DATE_SUFFIX)]
+            # A 4 MiB buffer turns the many per-row writes into a few large write() syscalls
+            with open(tmp_file, "wb", buffering=1 << 22) as raw, self.open_csv(raw, csv_file) as file:
+                writer = csv.writer(file)
+                writer.writerow(fieldnames)
+                # Bind the per-row callables once per endpoint so the loop uses fast local lookups
+                convert_date = self.convert_date
+                writerow = writer.writerow
+                # Transform and write each item in a single pass as it comes off the API
+                for item in chain([first], data):
+                    for key in date_keys:
+                        if key in item:
+                            item[key] = convert_date(item[key])
+                    # map(item.get, ...) looks up every cell in C; csv writes missing (None) values as ""
+                    writerow(map(item.get, fieldnames))
+            os.replace(tmp_file, csv_file)
+            return True
+        except FetchError:
+            # fetch_data has already logged the error; the previous CSV is kept as it was
+            return False
+        except IOError as e:
+            self.logger.error(f"Failed to write to CSV file: {csv_file}. Error: {e}")
+            return False
+        finally:
+            # Drop any partial output left behind by a failed fetch or write
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def open_csv(self, raw, csv_file):
         """
-        Transforms field values ending with '_date' from seconds format to 'dd-mm-yyyy' format.
+        Wraps a binary file for writing CSV text, gzip-compressing it if csv_file ends with '.gz'.
 
         Args:
-            data (list): The data to be transformed.
+            raw (io.BufferedWriter): The binary file the CSV is written to.
+            csv_file (str): The final path of the CSV file.
 
         Returns:
-            list: Transformed data.
+            io.TextIOWrapper: Writable text file object.
         """
-        transformed_data = []
-        for item in data:
-            transformed_item = {}
-            for key, value in item.items():
-                if key.endswith("_date"):
-                    transformed_item[key] = self.convert_date(value)
-                else:
-                    transformed_item[key] = value
-            transformed_data.append(transformed_item)
-        return transformed_data
-
-    def convert_date(self, seconds):
+        if csv_file.endswith(".gz"):
+            # Record the final file name in the gzip header rather than the temporary one;
+            # level 1 keeps compression cheap while still shrinking the output several times
+            compressed = gzip.GzipFile(filename=os.path.basename(csv_file), mode="wb", fileobj=raw, compresslevel=1)
+            return io.TextIOWrapper(io.BufferedWriter(compressed, buffer_size=1 << 22), encoding="utf-8", newline="")
+        return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+    @staticmethod
+    def convert_date(seconds):
         """
         Converts a date value from seconds format to 'dd-mm-yyyy' format.
 
@@ -118,122 +216,89 @@ class StackOverflowDataPipeline:
             str: Date value in 'dd-mm-yyyy' format.
         """
         if seconds:
-            return datetime.utcfromtimestamp(int(seconds)).strftime("%d-%m-%Y")
+            # Many values share a day, so cache on the day number rather than the raw timestamp
+            return StackOverflowDataPipeline.format_day(int(seconds) // 86400)
         return ""
 
+    @staticmethod
+    @lru_cache(maxsize=8192)
+    def format_day(days):
+        """
+        Formats a number of days since the Unix epoch as 'dd-mm-yyyy'.
+
+        Args:
+            days (int): The number of days since 01-01-1970.
+
+        Returns:
+            str: Date value in 'dd-mm-yyyy' format.
+        """
+        # Howard Hinnant's civil_from_days: integer-only conversion of a day count to a date
+        days += 719468
+        era = days // 146097
+        doe = days - era * 146097
+        yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+        doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+        mp = (5 * doy + 2) // 153
+        day = doy - (153 * mp + 2) // 5 + 1
+        month = mp + 3 if mp < 10 else mp - 9
+        year = yoe + era * 400 + (month <= 2)
+        return f"{day:02d}-{month:02d}-{year:04d}"
+
     def run_pipeline(self):
         """
         Runs the data pipeline to fetch and save Stack Overflow data.
         """
         self.logger.info("Starting the data pipeline.")
 
-        questions = self.fetch_questions()
-        if questions:
-            self.logger.info("Fetched Stack Overflow questions successfully.")
-            self.write_to_csv(questions, f"{self.output_dir}/stackoverflow_questions.csv")
-        else:
-            self.logger.warning("Failed to fetch Stack Overflow questions.")
-
-        posts = self.fetch_posts()
-        if posts:
-            self.logger.info("Fetched Stack Overflow posts successfully.")
-            self.write_to_csv(posts, f"{self.output_dir}/stackoverflow_posts.csv")
-        else:
-            self.logger.warning("Failed to fetch Stack Overflow posts.")
-
-        users = self.fetch_users()
-        if users:
-            self.logger.info("Fetched Stack Overflow users successfully.")
-            self.write_to_csv(users, f"{self.output_dir}/stackoverflow_users.csv")
-        else:
-            self.logger.warning("Failed to fetch Stack Overflow users.")
-
-        tags = self.fetch_tags()
-        if tags:
-            self.logger.info("Fetched Stack Overflow tags successfully.")
-            self.write_to_csv(tags, f"{self.output_dir}/stackoverflow_tags.csv")
-        else:
-            self.logger.warning("Failed to fetch Stack Overflow tags.")
-
-        comments = self.fetch_comments()
-        if comments:
-            self.logger.info("Fetched Stack Overflow comments successfully.")
-            self.write_to_csv(comments, f"{self.output_dir}/stackoverflow_comments.csv")
-        else:
-            self.logger.warning("Failed to fetch Stack Overflow comments.")
+        extension = ".csv.gz" if self.compress else ".csv"
+
+        try:
+            # The endpoints are independent, so stream each one into its CSV on its own thread;
+            # fetches share the session's connection pool and disk I/O overlaps the network
+            with ThreadPoolExecutor(max_workers=len(self.ENDPOINTS)) as executor:
+                futures = {}
+                for name, sort in self.ENDPOINTS:
+                    params = {
+                        "site": "stackoverflow",
+                        "order": "desc",
+                        "sort": sort,
+                        "pagesize": 100,
+                        "filter": "default"
+                    }
+                    data = self.fetch_data(f"{self.base_url}/{name}", params)
+                    futures[executor.submit(self.write_to_csv, data, f"{self.output_dir}/stackoverflow_{name}{extension}")] = name
+
+                for future in as_completed(futures):
+                    name = futures[future]
+                    if future.result():
+                        self.logger.info(f"Fetched Stack Overflow {name} successfully.")
+                    else:
+                        self.logger.warning(f"Failed to fetch Stack Overflow {name}.")
+        finally:
+            # Release the pooled connections and the cache even if a worker raised
+            self.session.close()
 
         self.logger.info("Data saved successfully in separate CSV files.")
         self.logger.info("Data pipeline completed.")
 
-    def fetch_questions(self):
-        """
-        Fetches Stack Overflow questions from the API.
 
-        Returns:
-            list: List of question items.
-        """
-        params = {
-            "site": "stackoverflow",
-            "order": "desc",
-            "sort": "votes"
-        }
-        return self.fetch_data(f"{self.base_url}/questions", params)
-
-    def fetch_posts(self):
-        """
-        Fetches Stack Overflow posts from the API.
-
-        Returns:
-            list: List of post items.
-        """
-        params = {
-            "site": "stackoverflow",
-            "order": "desc",
-            "sort": "votes"
-        }
-        return self.fetch_data(f"{self.base_url}/posts", params)
-
-    def fetch_users(self):
-        """
-        Fetches Stack Overflow users from the API.
-
-        Returns:
-            list: List of user items.
-        """
-        params = {
-            "site": "stackoverflow",
-            "order": "desc",
-            "sort": "reputation"
-        }
-        return self.fetch_data(f"{self.base_url}/users", params)
-
-    def fetch_tags(self):
-        """
-        Fetches Stack Overflow tags from the API.
+def positive_int(value):
+    """
+    Parses a command-line value as an integer of at least 1.
 
-        Returns:
-            list: List of tag items.
-        """
-        params = {
-            "site": "stackoverflow",
-            "order": "desc",
-            "sort": "popular"
-        }
-        return self.fetch_data(f"{self.base_url}/tags", params)
-
-    def fetch_comments(self):
-        """
-        Fetches Stack Overflow comments from the API.
+    Args:
+        value (str): The raw argument value.
 
-        Returns:
-            list: List of comment items.
-        """
-        params = {
-            "site": "stackoverflow",
-            "order": "desc",
-            "sort": "votes"
-        }
-        return self.fetch_data(f"{self.base_url}/comments", params)
+    Returns:
+        int: Parsed value.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
 
 
 def parse_arguments():
@@ -245,14 +310,16 @@ def parse_arguments():
     """
     parser = argparse.ArgumentParser(description="Stack Overflow DataPipeline")
     parser.add_argument("--output-dir", "-o", default="output", help="Output directory for CSV files")
+    parser.add_argument("--max-pages", "-p", type=positive_int, default=1, help="Maximum number of pages of 100 items to fetch per endpoint")
+    parser.add_argument("--gzip", "-z", action="store_true", help="Write gzip-compressed .csv.gz files")
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = parse_arguments()
 
-    # Instantiate the StackOverflowDataPipeline class with the provided output directory
-    pipeline = StackOverflowDataPipeline(args.output_dir)
+    # Instantiate the StackOverflowDataPipeline class with the provided output directory and options
+    pipeline = StackOverflowDataPipeline(args.output_dir, args.max_pages, args.gzip)
 
     # Run the data pipeline
     pipeline.run_pipeline()